@@ -3,21 +3,44 @@
 Generate CIDR lists from parsed APNIC data
 """
 
-import json
+import gzip
 import os
+import orjson
 import ipaddress
-from typing import Dict, List
+import socket
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from parse_apnic_data import IPEntry, ipv4_to_int, int_to_ipv4
 
 def load_data(data_file: str) -> Dict:
     """Load parsed data"""
-    with open(data_file, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    opener = gzip.open if data_file.endswith('.gz') else open
+    with opener(data_file, 'rb') as f:
+        data = orjson.loads(f.read())
+        
+    for ip_type in ('ipv4', 'ipv6', 'asn'):
+        data[ip_type] = [IPEntry(**entry) for entry in data[ip_type]]
+    return data
+
+def find_data_file(data_file: str) -> str:
+    """Return the newer of data_file and its .gz variant, data_file if neither exists"""
+    candidates = [path for path in (data_file, f"{data_file}.gz") if os.path.exists(path)]
+    if not candidates:
+        return data_file
+    return max(candidates, key=os.path.getmtime)
 
 def ip_to_sort_key(ip_str: str) -> tuple:
     """Convert IP address to sortable key for both IPv4 and IPv6"""
     try:
         # Remove CIDR notation for sorting
         ip_part = ip_str.split('/')[0]
+        try:
+            # Fast path for IPv4
+            return (0, ipv4_to_int(ip_part))
+        except OSError:
+            pass
+            
         ip_obj = ipaddress.ip_address(ip_part)
         
         if isinstance(ip_obj, ipaddress.IPv4Address):
@@ -31,25 +54,91 @@ def ip_to_sort_key(ip_str: str) -> tuple:
         # Return a fallback key for invalid addresses
         return (2, ip_str)
 
-def generate_cidr_list(data: Dict, ip_type: str = 'ipv4', country: str = None) -> List[str]:
-    """Generate CIDR list"""
-    cidr_list = []
+def build_sort_keys(data: Dict) -> Dict[str, tuple]:
+    """Precompute the sort key of every unique CIDR once"""
+    sort_keys = {}
+    for ip_type in ('ipv4', 'ipv6'):
+        for entry in data[ip_type]:
+            cidr = entry.cidr
+            if cidr is not None and cidr not in sort_keys:
+                sort_keys[cidr] = ip_to_sort_key(cidr)
+    return sort_keys
+
+def build_country_index(data: Dict) -> Dict[str, Dict[str, List[str]]]:
+    """Index CIDRs by address family and country in a single pass"""
+    index = {}
+    for ip_type in ('ipv4', 'ipv6'):
+        index[ip_type] = defaultdict(list)
+        for entry in data[ip_type]:
+            if entry.cidr is not None:
+                index[ip_type][entry.country].append(entry.cidr)
+    return index
+
+def generate_cidr_list(data: Dict, ip_type: str = 'ipv4', country: str = None,
+                       sort_keys: Optional[Dict[str, tuple]] = None,
+                       index: Optional[Dict[str, Dict[str, List[str]]]] = None) -> List[str]:
+    """Generate CIDR list, answering country queries from a build_country_index() index when given"""
+    if country and index is not None:
+        cidr_list = index[ip_type].get(country, [])
+    else:
+        cidr_list = [entry.cidr for entry in data[ip_type]
+                     if entry.cidr is not None and (not country or entry.country == country)]
+        
+    # Sort using the precomputed keys when available
+    key = sort_keys.__getitem__ if sort_keys is not None else ip_to_sort_key
+    return sorted(cidr_list, key=key)
+
+def collapse_cidr_list(cidr_list: List[str], ip_type: str = 'ipv4') -> List[str]:
+    """Merge adjacent and overlapping CIDRs into the smallest equivalent list"""
+    bits = 32 if ip_type == 'ipv4' else 128
+    family = socket.AF_INET if ip_type == 'ipv4' else socket.AF_INET6
     
-    for entry in data[ip_type]:
-        if country and entry['country'] != country:
-            continue
-            
-        if 'cidr' in entry:
-            cidr_list.append(entry['cidr'])
+    # Same result as ipaddress.collapse_addresses, computed on integer
+    # ranges instead of network objects
+    ranges = []
+    for cidr in cidr_list:
+        address, _, prefix = cidr.partition('/')
+        size = 1 << (bits - (int(prefix) if prefix else bits))
+        start = int.from_bytes(socket.inet_pton(family, address), 'big') & ~(size - 1)
+        ranges.append((start, start + size - 1))
+    ranges.sort()
+    
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
             
-    # Sort using the new sorting function
-    return sorted(cidr_list, key=ip_to_sort_key)
+    collapsed = []
+    for start, end in merged:
+        # Split each merged range into the largest aligned blocks
+        while start <= end:
+            size_bits = min((start & -start).bit_length() - 1 if start else bits,
+                            (end - start + 1).bit_length() - 1)
+            if ip_type == 'ipv4':
+                address = int_to_ipv4(start)
+            else:
+                address = str(ipaddress.IPv6Address(start))
+            collapsed.append(f"{address}/{bits - size_bits}")
+            start += 1 << size_bits
+    return collapsed
 
 def save_cidr_list(cidr_list: List[str], output_file: str):
     """Save CIDR list to file"""
     with open(output_file, 'w', encoding='utf-8') as f:
-        for cidr in cidr_list:
-            f.write(f"{cidr}\n")
+        if cidr_list:
+            f.write("\n".join(cidr_list) + "\n")
+
+def save_lookup_index(ipv4_entries: List[IPEntry], ipv6_entries: List[IPEntry], output_file: str):
+    """Save sorted (start, end, country) ranges for binary-search lookups"""
+    index = {
+        'ipv4': [[entry.start, entry.end, entry.country] for entry in ipv4_entries],
+        'ipv6': [[entry.start, entry.end, entry.country] for entry in ipv6_entries]
+    }
+    with open(output_file, 'wb') as f:
+        f.write(orjson.dumps(index))
 
 def validate_cidr(cidr: str) -> bool:
     """Validate CIDR notation"""
@@ -59,71 +148,66 @@ def validate_cidr(cidr: str) -> bool:
     except Exception:
         return False
 
-def main():
-    data_file = "data/apnic_data.json"
-    
-    if not os.path.exists(data_file):
-        print(f"Data file {data_file} not found. Please run parse_apnic_data.py first.")
-        return
+def main(data: Optional[Dict] = None):
+    """Generate all CIDR lists, loading the parsed data from disk unless given"""
+    if data is None:
+        data_file = find_data_file("data/apnic_data.json")
         
-    data = load_data(data_file)
+        if not os.path.exists(data_file):
+            print(f"Data file {data_file} not found. Please run parse_apnic_data.py first.")
+            return
+            
+        data = load_data(data_file)
+        
+    sort_keys = build_sort_keys(data)
     
     # Create output directory
     os.makedirs("data/cidr_lists", exist_ok=True)
     
-    # Generate all IPv4 CIDR list
-    all_ipv4_cidr = generate_cidr_list(data, 'ipv4')
-    # Filter out invalid CIDR entries
-    valid_ipv4_cidr = [cidr for cidr in all_ipv4_cidr if validate_cidr(cidr)]
-    save_cidr_list(valid_ipv4_cidr, "data/cidr_lists/all_ipv4.txt")
-    print(f"Generated all IPv4 CIDR list: {len(valid_ipv4_cidr)} entries")
+    # Sort each address family once with the precomputed keys; the parser
+    # only emits entries with a valid CIDR, so no re-validation
+    ipv4_entries = sorted((entry for entry in data['ipv4'] if entry.cidr is not None),
+                          key=lambda entry: sort_keys[entry.cidr])
+    ipv6_entries = sorted((entry for entry in data['ipv6'] if entry.cidr is not None),
+                          key=lambda entry: sort_keys[entry.cidr])
     
-    # Generate all IPv6 CIDR list
-    all_ipv6_cidr = generate_cidr_list(data, 'ipv6')
-    # Filter out invalid CIDR entries
-    valid_ipv6_cidr = [cidr for cidr in all_ipv6_cidr if validate_cidr(cidr)]
-    save_cidr_list(valid_ipv6_cidr, "data/cidr_lists/all_ipv6.txt")
-    print(f"Generated all IPv6 CIDR list: {len(valid_ipv6_cidr)} entries")
+    # Group CIDR lists by country in sorted order, so every country list
+    # is already sorted without a per-country sort
+    index = build_country_index({'ipv4': ipv4_entries, 'ipv6': ipv6_entries})
+    countries_ipv4 = index['ipv4']
+    countries_ipv6 = index['ipv6']
+    
+    # Merge adjacent allocations once per country
+    for country, cidr_list in countries_ipv4.items():
+        countries_ipv4[country] = collapse_cidr_list(cidr_list)
+    for country, cidr_list in countries_ipv6.items():
+        countries_ipv6[country] = collapse_cidr_list(cidr_list, 'ipv6')
     
-    # Generate China IPv4 CIDR list
-    cn_ipv4_cidr = generate_cidr_list(data, 'ipv4', 'CN')
-    valid_cn_ipv4_cidr = [cidr for cidr in cn_ipv4_cidr if validate_cidr(cidr)]
-    save_cidr_list(valid_cn_ipv4_cidr, "data/cidr_lists/cn_ipv4.txt")
-    print(f"Generated China IPv4 CIDR list: {len(valid_cn_ipv4_cidr)} entries")
+    # Generate all IPv4 CIDR list
+    all_ipv4_cidr = collapse_cidr_list([entry.cidr for entry in ipv4_entries])
+    save_cidr_list(all_ipv4_cidr, "data/cidr_lists/all_ipv4.txt")
+    print(f"Generated all IPv4 CIDR list: {len(all_ipv4_cidr)} entries")
     
-    # Generate China IPv6 CIDR list
-    cn_ipv6_cidr = generate_cidr_list(data, 'ipv6', 'CN')
-    valid_cn_ipv6_cidr = [cidr for cidr in cn_ipv6_cidr if validate_cidr(cidr)]
-    save_cidr_list(valid_cn_ipv6_cidr, "data/cidr_lists/cn_ipv6.txt")
-    print(f"Generated China IPv6 CIDR list: {len(valid_cn_ipv6_cidr)} entries")
+    # Generate all IPv6 CIDR list
+    all_ipv6_cidr = collapse_cidr_list([entry.cidr for entry in ipv6_entries], 'ipv6')
+    save_cidr_list(all_ipv6_cidr, "data/cidr_lists/all_ipv6.txt")
+    print(f"Generated all IPv6 CIDR list: {len(all_ipv6_cidr)} entries")
     
-    # Generate CIDR lists grouped by country
-    countries_ipv4 = {}
-    countries_ipv6 = {}
+    # China lists are written with the other countries below
+    print(f"Generated China IPv4 CIDR list: {len(countries_ipv4.get('CN', []))} entries")
+    print(f"Generated China IPv6 CIDR list: {len(countries_ipv6.get('CN', []))} entries")
     
-    for entry in data['ipv4']:
-        country = entry['country']
-        if country not in countries_ipv4:
-            countries_ipv4[country] = []
-        if 'cidr' in entry and validate_cidr(entry['cidr']):
-            countries_ipv4[country].append(entry['cidr'])
-            
-    for entry in data['ipv6']:
-        country = entry['country']
-        if country not in countries_ipv6:
-            countries_ipv6[country] = []
-        if 'cidr' in entry and validate_cidr(entry['cidr']):
-            countries_ipv6[country].append(entry['cidr'])
+    # Save IPv4 and IPv6 lists for each country, overlapping the file writes
+    cidr_lists = list(countries_ipv4.values()) + list(countries_ipv6.values())
+    output_files = ([f"data/cidr_lists/{country.lower()}_ipv4.txt" for country in countries_ipv4] +
+                    [f"data/cidr_lists/{country.lower()}_ipv6.txt" for country in countries_ipv6])
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        # Consume the results so write errors are raised here
+        list(executor.map(save_cidr_list, cidr_lists, output_files))
     
-    # Save IPv4 list for each country
-    for country, cidr_list in countries_ipv4.items():
-        sorted_cidr = sorted(cidr_list, key=ip_to_sort_key)
-        save_cidr_list(sorted_cidr, f"data/cidr_lists/{country.lower()}_ipv4.txt")
-        
-    # Save IPv6 list for each country
-    for country, cidr_list in countries_ipv6.items():
-        sorted_cidr = sorted(cidr_list, key=ip_to_sort_key)
-        save_cidr_list(sorted_cidr, f"data/cidr_lists/{country.lower()}_ipv6.txt")
+    # Save lookup index for IP to country queries
+    save_lookup_index(ipv4_entries, ipv6_entries, "data/ip_lookup.json")
+    print(f"Generated IP lookup index: {len(ipv4_entries) + len(ipv6_entries)} ranges")
     
     print(f"Generated CIDR lists for {len(countries_ipv4)} countries (IPv4)")
     print(f"Generated CIDR lists for {len(countries_ipv6)} countries (IPv6)")
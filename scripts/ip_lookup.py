@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+IP to country lookup
+Answers queries from the lookup index written by generate_cidr_lists.py
+"""
+
+import bisect
+import ipaddress
+import sys
+import orjson
+from typing import Dict, List, Optional
+
+class IPLookup:
+    def __init__(self, index_file: str = "data/ip_lookup.json"):
+        with open(index_file, 'rb') as f:
+            index = orjson.loads(f.read())
+
+        # Ranges are sorted by start address and do not overlap, so the
+        # candidate for an address is the last range starting at or before it
+        self.starts: Dict[int, List[int]] = {}
+        self.ends: Dict[int, List[int]] = {}
+        self.countries: Dict[int, List[str]] = {}
+        for version, ip_type in ((4, 'ipv4'), (6, 'ipv6')):
+            ranges = index.get(ip_type, [])
+            self.starts[version] = [int(ipaddress.ip_address(start)) for start, _, _ in ranges]
+            self.ends[version] = [int(ipaddress.ip_address(end)) for _, end, _ in ranges]
+            self.countries[version] = [country for _, _, country in ranges]
+
+    def lookup(self, ip: str) -> Optional[str]:
+        """Return the country code for an IP address, or None if not allocated"""
+        address = ipaddress.ip_address(ip)
+        value = int(address)
+        pos = bisect.bisect_right(self.starts[address.version], value) - 1
+        if pos >= 0 and value <= self.ends[address.version][pos]:
+            return self.countries[address.version][pos]
+        return None
+
+if __name__ == "__main__":
+    lookup = IPLookup()
+    for ip in sys.argv[1:]:
+        try:
+            print(f"{ip}: {lookup.lookup(ip) or 'not found'}")
+        except ValueError:
+            print(f"{ip}: invalid address")
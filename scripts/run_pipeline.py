@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+Run the complete APNIC pipeline in one process
+Parses the APNIC data and generates the CIDR lists without reloading the JSON output
+"""
+
+from parse_apnic_data import APNICParser
+import generate_cidr_lists
+
+def main():
+    parser = APNICParser()
+    try:
+        # Start the download and parse lines as they stream in
+        raw_data = parser.download_data()
+        parsed_data = parser.parse_data(raw_data)
+
+        # Save JSON data for consumers
+        parser.save_data(parsed_data)
+
+        # Generate CIDR lists from the in-memory data
+        generate_cidr_lists.main(data=parsed_data)
+
+        print("APNIC pipeline completed successfully!")
+
+    except Exception as e:
+        print(f"Error running APNIC pipeline: {e}")
+        raise
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,10 @@ import json
 import tempfile
 import os
 from parse_apnic_data import APNICParser
-from generate_cidr_lists import generate_cidr_list, validate_cidr, ip_to_sort_key
+from generate_cidr_lists import (load_data, find_data_file, generate_cidr_list, validate_cidr,
+                                 ip_to_sort_key, build_country_index, collapse_cidr_list,
+                                 save_lookup_index)
+from ip_lookup import IPLookup
 
 def test_sample_data():
     """Test with sample APNIC data"""
@@ -41,6 +44,29 @@ apnic|AU|asn|1221|1|19930901|allocated"""
         print(f"IPv6 entries: {len(parsed_data['ipv6'])}")
         print(f"ASN entries: {len(parsed_data['asn'])}")
         
+        # Test single line parsing
+        entry = parser.parse_line("apnic|CN|ipv4|1.0.1.0|256|20110414|allocated")
+        assert entry is not None and entry.country == 'CN' and entry.count == 256, entry
+        for line in ["", "# comment", "apnic|*|ipv4|*|53070|summary",
+                     "apnic|CN|ipv4|1.0.1.0|0|20110414|allocated",
+                     "apnic|CN|ipv4|1.0.1.0| 256|20110414|allocated",
+                     "apnic|CN|ipv4|1.0.1.0|+256|20110414|allocated",
+                     "apnic|CN|ipv4|1.0.1.0|2_56|20110414|allocated"]:
+            assert parser.parse_line(line) is None, line
+        
+        # Test invalid ranges are rejected
+        assert parser.calculate_ip_range("1.0.0.256", 256, 'ipv4') is None
+        assert parser.calculate_ip_range("255.255.255.0", 512, 'ipv4') is None
+        assert parser.calculate_ip_range("2001:db8::g", 32, 'ipv6') is None
+        assert parser.calculate_ip_range("2001:200::", 200, 'ipv6') is None
+        assert parser.calculate_ip_range("2001:200::1", 32, 'ipv6') is None
+        assert parser.calculate_ip_range("2001:200::", 32, 'ipv6') == {
+            'start': '2001:200::', 'end': '2001:200:ffff:ffff:ffff:ffff:ffff:ffff', 'cidr': '2001:200::/32'
+        }
+        assert parser.calculate_ip_range("1.0.1.0", 256, 'ipv4') == {
+            'start': '1.0.1.0', 'end': '1.0.1.255', 'cidr': '1.0.1.0/24'
+        }
+        
         # Test CIDR generation
         print("\nTesting CIDR generation...")
         ipv4_cidr = generate_cidr_list(parsed_data, 'ipv4')
@@ -53,6 +79,15 @@ apnic|AU|asn|1221|1|19930901|allocated"""
         print(f"IPv6 CIDR entries: {len(ipv6_cidr)}")
         for cidr in ipv6_cidr:
             print(f"  {cidr}")
+            
+        # Test country CIDR lists, with and without a prebuilt index
+        index = build_country_index(parsed_data)
+        cn_ipv4_cidr = generate_cidr_list(parsed_data, 'ipv4', 'CN', index=index)
+        assert cn_ipv4_cidr == ["1.0.1.0/24", "1.0.2.0/23"], cn_ipv4_cidr
+        assert generate_cidr_list(parsed_data, 'ipv4', 'CN') == cn_ipv4_cidr
+        assert generate_cidr_list(parsed_data, 'ipv6', 'AU', index=index) == []
+        assert '_country_index' not in parsed_data
+        print(f"CN IPv4 CIDR entries: {len(cn_ipv4_cidr)}")
         
         # Test validation
         print("\nTesting CIDR validation...")
@@ -82,6 +117,53 @@ apnic|AU|asn|1221|1|19930901|allocated"""
         for ip in sorted_ips:
             print(f"  {ip}")
         
+        # Test CIDR collapsing
+        print("\nTesting CIDR collapsing...")
+        collapsed_ipv4 = collapse_cidr_list(["1.0.0.0/24", "1.0.1.0/24", "1.0.2.0/23", "1.0.8.0/24"])
+        collapsed_ipv6 = collapse_cidr_list(["2001:db8::/33", "2001:db8:8000::/33"], 'ipv6')
+        assert collapsed_ipv4 == ["1.0.0.0/22", "1.0.8.0/24"], collapsed_ipv4
+        assert collapsed_ipv6 == ["2001:db8::/32"], collapsed_ipv6
+        for cidr in collapsed_ipv4 + collapsed_ipv6:
+            print(f"  {cidr}")
+        
+        # Test saving and loading plain and gzipped data
+        print("\nTesting data save/load...")
+        data_file = os.path.join(temp_dir, "apnic_data.json")
+        for compress in (False, True):
+            parser.compress = compress
+            parser.save_data(parsed_data)
+            expected_file = f"{data_file}.gz" if compress else data_file
+            assert find_data_file(data_file) == expected_file, find_data_file(data_file)
+            assert os.path.exists(data_file) != compress, "stale data file left behind"
+            loaded_data = load_data(expected_file)
+            for ip_type in ('ipv4', 'ipv6', 'asn'):
+                assert loaded_data[ip_type] == parsed_data[ip_type], ip_type
+            print(f"  {os.path.basename(expected_file)}: ✓")
+        
+        # Test IP lookup
+        print("\nTesting IP lookup...")
+        index_file = os.path.join(temp_dir, "ip_lookup.json")
+        save_lookup_index(
+            sorted(parsed_data['ipv4'], key=lambda entry: ip_to_sort_key(entry.cidr)),
+            sorted(parsed_data['ipv6'], key=lambda entry: ip_to_sort_key(entry.cidr)),
+            index_file
+        )
+        lookup = IPLookup(index_file)
+        test_lookups = {
+            "1.0.2.200": "CN",
+            "8.8.8.8": "US",
+            "2001:200::1": "JP",
+            "2001:200:1::1": "JP",
+            "2001:db8:ffff::1": "CN",
+            "2001:db9::1": None,
+            "9.9.9.9": None
+        }
+        
+        for ip, expected in test_lookups.items():
+            country = lookup.lookup(ip)
+            assert country == expected, f"{ip}: expected {expected}, got {country}"
+            print(f"  {ip}: {country or 'not found'}")
+        
         print("\nAll tests completed successfully!")
 
 if __name__ == "__main__":